@@ -4,9 +4,17 @@ A complete leave management system with document Q&A capabilities
 """
 
 from fastmcp import FastMCP
-from datetime import datetime, timedelta
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
 from typing import Optional, List, Dict
+import heapq
 import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from operator import itemgetter
 
 # Initialize FastMCP server
 mcp = FastMCP("Leave Management RAG")
@@ -17,8 +25,523 @@ leave_requests = []
 leave_balance = {}
 knowledge_base = {}  # Simple document store for RAG
 
+# Secondary indexes over leave_requests so lookups by employee or status
+# are O(1) dict access instead of scanning the whole list on every call.
+# Pending requests get their own pool keyed by request_id: it's the only
+# status requests leave again, and popping a dict entry beats a list.remove
+# on an ever-growing bucket
+requests_by_employee: Dict[str, List[dict]] = defaultdict(list)
+requests_by_status: Dict[str, List[dict]] = defaultdict(list)
+requests_by_id: Dict[str, dict] = {}
+pending_requests: Dict[str, dict] = {}
+
+# Department buckets (keyed on the lowercased name) so summaries only touch
+# the employees of the department being reported on
+employees_by_dept: Dict[str, set] = defaultdict(set)
+
+# Display-name department counts, kept live so system_stats doesn't rebuild
+# a set over every employee per call
+dept_counts: Counter = Counter()
+
+# Inverted index over policy documents, built once at ingest time so each
+# query only touches the posting lists of its own terms instead of
+# rescanning every document's content
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+postings: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+title_terms: Dict[str, frozenset] = {}
+doc_category_lower: Dict[str, str] = {}  # policy_id -> lowercased category
+
+
+# ========== PERSISTENCE ==========
+
+# All state is written through to SQLite so restarts hydrate from disk
+# instead of starting empty; embeddings are stored as float32 BLOBs in the
+# same row as the policy text, so a cold start loads vectors straight into
+# the embedding matrix rather than re-encoding the whole corpus
+_DB_PATH = os.environ.get(
+    "LEAVE_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "leave_manager.db")
+)
+_db = None
+
+
+def _get_db():
+    """Open (and on first use initialise) the SQLite state database"""
+    global _db
+    if _db is None:
+        # FastMCP runs sync tools on worker threads, so the cached
+        # connection must be usable off the creating thread; all writes
+        # here are single-statement autocommits, which WAL handles safely
+        _db = sqlite3.connect(_DB_PATH, isolation_level=None, check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute("""
+            CREATE TABLE IF NOT EXISTS employees (
+                employee_id TEXT PRIMARY KEY,
+                name TEXT,
+                email TEXT,
+                department TEXT,
+                join_date TEXT,
+                status TEXT,
+                leave_balance INTEGER
+            )""")
+        _db.execute("""
+            CREATE TABLE IF NOT EXISTS requests (
+                request_id TEXT PRIMARY KEY,
+                employee_id TEXT,
+                status TEXT,
+                data TEXT
+            )""")
+        _db.execute("CREATE INDEX IF NOT EXISTS idx_requests_employee ON requests(employee_id)")
+        _db.execute("CREATE INDEX IF NOT EXISTS idx_requests_status ON requests(status)")
+        _db.execute("""
+            CREATE TABLE IF NOT EXISTS policies (
+                policy_id TEXT PRIMARY KEY,
+                title TEXT,
+                content TEXT,
+                category TEXT,
+                created_at TEXT,
+                embedding BLOB
+            )""")
+    return _db
+
+
+def _save_request(req: dict):
+    """Write a request's current state through to SQLite"""
+    # Upsert rather than INSERT OR REPLACE: a replace assigns a fresh
+    # rowid, and load_state relies on rowid order to restore submission order
+    _get_db().execute(
+        "INSERT INTO requests (request_id, employee_id, status, data) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(request_id) DO UPDATE SET status = excluded.status, data = excluded.data",
+        (req["request_id"], req["employee_id"], req["status"], json.dumps(req))
+    )
+
+
+def _save_balance(employee_id: str):
+    _get_db().execute(
+        "UPDATE employees SET leave_balance = ? WHERE employee_id = ?",
+        (leave_balance.get(employee_id, 0), employee_id)
+    )
+
+
+# Closed keyword vocabularies are normalised through interned lookup
+# tables: one case-fold per call, then identity comparisons thereafter
+# instead of repeated .lower() + equality chains
+_LEAVE_TYPE_TABLE = {w.lower(): sys.intern(w) for w in ("Annual", "Sick", "Emergency", "Unpaid")}
+_STATUS_TABLE = {w.lower(): sys.intern(w) for w in ("All", "Pending", "Approved", "Rejected")}
+_ANNUAL = _LEAVE_TYPE_TABLE["annual"]
+_ALL = _STATUS_TABLE["all"]
+
+
+def _normalize_kw(s: str, table: Dict[str, str]) -> Optional[str]:
+    """Map a case-insensitive keyword to its interned canonical form"""
+    return table.get(s.lower())
+
+
+# Timestamp strings are memoised with a 1-second TTL so bursts of tool
+# calls share one strftime instead of re-formatting on every invocation
+_today_cache = [0, ""]
+_now_cache = [0, ""]
+
+
+def _today_str() -> str:
+    """Current date as YYYY-MM-DD, refreshed at most once per second"""
+    t = int(time.time())
+    if t != _today_cache[0]:
+        _today_cache[0] = t
+        _today_cache[1] = datetime.now().strftime("%Y-%m-%d")
+    return _today_cache[1]
+
+
+def _now_str() -> str:
+    """Current timestamp as YYYY-MM-DD HH:MM:SS, refreshed at most once per second"""
+    t = int(time.time())
+    if t != _now_cache[0]:
+        _now_cache[0] = t
+        _now_cache[1] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return _now_cache[1]
+
+
+def _move_status(request: dict, new_status: str):
+    """Move a request out of the pending pool into a terminal status bucket"""
+    pending_requests.pop(request["request_id"], None)
+    request["status"] = new_status
+    requests_by_status[new_status].append(request)
+
+
+def _status_requests(status: str):
+    """All requests currently in the given status bucket"""
+    if status == "Pending":
+        return pending_requests.values()
+    return requests_by_status[status]
+
 # ========== KNOWLEDGE BASE / RAG SYSTEM ==========
 
+# Embedding-based retrieval is optional: when sentence-transformers is
+# installed we encode documents once and answer queries with a single
+# inner-product search; otherwise the keyword index below is used
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+    _EMB_AVAILABLE = True
+except ImportError:
+    _EMB_AVAILABLE = False
+
+_EMB_DIM = 384  # all-MiniLM-L6-v2 output dimension
+_model = None
+# Document embeddings live in one contiguous float32 matrix (rows are
+# L2-normalized at insert time) so scoring a query is a single BLAS matmul;
+# the matrix doubles in place of per-append reallocation
+_E = None
+_E_rows_used = 0
+_id_list: List[str] = []  # row position in _E -> policy_id
+
+
+def _get_model():
+    """Lazily load the encoder so import stays cheap when RAG is unused"""
+    global _model
+    if _model is None:
+        _model = SentenceTransformer("all-MiniLM-L6-v2")
+    return _model
+
+
+# Optional ONNX Runtime encoder. Export the model once with
+#   optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 onnx_model/
+# and encoding runs through an int8-quantized ORT session instead of torch,
+# roughly doubling CPU throughput via VNNI int8 matmuls
+try:
+    import onnxruntime
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoTokenizer
+    _ORT_AVAILABLE = True
+except ImportError:
+    _ORT_AVAILABLE = False
+
+_ONNX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx_model")
+_ort_session = None
+_ort_tokenizer = None
+
+
+def _get_ort_session():
+    """Load the exported ONNX encoder, quantizing it to int8 on first use"""
+    global _ort_session, _ort_tokenizer
+    if _ort_session is None:
+        fp32_path = os.path.join(_ONNX_DIR, "model.onnx")
+        int8_path = os.path.join(_ONNX_DIR, "model_int8.onnx")
+        if not os.path.exists(int8_path):
+            quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        _ort_session = onnxruntime.InferenceSession(
+            int8_path, providers=["CPUExecutionProvider"]
+        )
+        _ort_tokenizer = AutoTokenizer.from_pretrained(_ONNX_DIR)
+    return _ort_session
+
+
+def _encode(texts: List[str]):
+    """Encode texts to L2-normalized float32 vectors, preferring the ORT path"""
+    if _ORT_AVAILABLE and os.path.isdir(_ONNX_DIR):
+        session = _get_ort_session()
+        enc = _ort_tokenizer(texts, padding=True, truncation=True, return_tensors="np")
+        input_names = {i.name for i in session.get_inputs()}
+        hidden = session.run(None, {k: v for k, v in enc.items() if k in input_names})[0]
+        # Mean-pool token states over the attention mask, then normalize,
+        # matching what SentenceTransformer.encode does internally
+        mask = enc["attention_mask"][:, :, None].astype(np.float32)
+        vecs = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        vecs = vecs.astype(np.float32)
+        vecs /= np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+        return vecs
+    return _get_model().encode(texts, normalize_embeddings=True)
+
+
+def _append_embeddings(vecs):
+    """Write normalized vectors into the next free rows of _E, growing 2x as needed"""
+    global _E, _E_rows_used
+    n = len(vecs)
+    if _E is None:
+        size = 16
+        while size < n:
+            size *= 2
+        _E = np.empty((size, _EMB_DIM), dtype=np.float32)
+    while _E_rows_used + n > len(_E):
+        grown = np.empty((len(_E) * 2, _EMB_DIM), dtype=np.float32)
+        grown[:_E_rows_used] = _E[:_E_rows_used]
+        _E = grown
+    _E[_E_rows_used:_E_rows_used + n] = vecs
+    _E_rows_used += n
+
+
+def _store_embedding(policy_id: str, vec):
+    """Insert the policy's vector, overwriting its existing row on re-add"""
+    if policy_id in _id_list:
+        _E[_id_list.index(policy_id)] = vec
+    else:
+        _append_embeddings(vec.reshape(1, _EMB_DIM))
+        _id_list.append(policy_id)
+
+
+# Semantic answer cache for ask_policy_question: random-projection LSH over
+# query embeddings lets near-duplicate (paraphrased) questions short-circuit
+# to the cached result instead of re-running retrieval
+_QA_HASH_TABLES = 4
+_QA_HASH_BITS = 16
+_QA_SIM_THRESHOLD = 0.95
+_qa_cache: List[tuple] = []  # (query embedding, category, cached result)
+_qa_tables: Optional[List[Dict[int, List[int]]]] = None
+_qa_projections = None
+
+
+def _qa_keys(q) -> List[int]:
+    """LSH keys for a query embedding: sign bits of random projections"""
+    global _qa_projections
+    if _qa_projections is None:
+        rng = np.random.default_rng(42)
+        _qa_projections = [
+            rng.standard_normal((_EMB_DIM, _QA_HASH_BITS)).astype(np.float32)
+            for _ in range(_QA_HASH_TABLES)
+        ]
+    keys = []
+    for projection in _qa_projections:
+        key = 0
+        for bit in (q @ projection) > 0:
+            key = (key << 1) | int(bit)
+        keys.append(key)
+    return keys
+
+
+def _qa_cache_get(q, category: Optional[str]) -> Optional[dict]:
+    """Return the cached answer for a near-duplicate question, if any"""
+    if _qa_tables is None:
+        return None
+    candidates = set()
+    for table, key in zip(_qa_tables, _qa_keys(q)):
+        candidates.update(table.get(key, ()))
+    # Verify candidates with exact cosine (vectors are already normalized)
+    for slot in candidates:
+        cached_q, cached_category, result = _qa_cache[slot]
+        if cached_category == category and float(q @ cached_q) >= _QA_SIM_THRESHOLD:
+            return result
+    return None
+
+
+def _qa_cache_put(q, category: Optional[str], result: dict):
+    global _qa_tables
+    if _qa_tables is None:
+        _qa_tables = [{} for _ in range(_QA_HASH_TABLES)]
+    slot = len(_qa_cache)
+    _qa_cache.append((q, category, result))
+    for table, key in zip(_qa_tables, _qa_keys(q)):
+        table.setdefault(key, []).append(slot)
+
+
+def _qa_cache_clear():
+    """Drop cached answers; called whenever the knowledge base changes"""
+    _qa_cache.clear()
+    if _qa_tables is not None:
+        for table in _qa_tables:
+            table.clear()
+
+
+def _result_entry(doc: dict, score) -> dict:
+    """Build one search_policies result row for a scored document"""
+    return {
+        "policy_id": doc["policy_id"],
+        "title": doc["title"],
+        "category": doc["category"],
+        "relevance_score": score,
+        "excerpt": doc["excerpt"],
+        "full_content": doc["content"]
+    }
+
+
+def _search_semantic(query: str, category: Optional[str], max_results: int,
+                     q=None) -> List[dict]:
+    """One encoder call + one matmul over the contiguous embedding matrix.
+
+    Callers that already hold the query embedding (the ask_policy_question
+    cache path) pass it as q so the query is only encoded once.
+    """
+    if q is None:
+        q = _encode([query])[0]
+    scores = _E[:_E_rows_used] @ q
+
+    # Over-fetch so the category filter still leaves enough candidates;
+    # argpartition picks the top k in O(n), then only those k get sorted
+    k = min(_E_rows_used, max_results * 3)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+
+    results = []
+    for idx in top:
+        score = scores[idx]
+        # Candidates are sorted by score, so once similarity drops to zero
+        # nothing relevant is left; returning them would break the
+        # "couldn't find any relevant documents" contract upstream
+        if score <= 0:
+            break
+        doc = knowledge_base[_id_list[idx]]
+
+        if category and doc["category"].lower() != category.lower():
+            continue
+
+        results.append(_result_entry(doc, round(float(score), 4)))
+        if len(results) == max_results:
+            break
+
+    return results
+
+
+# Numba-compiled scoring for the keyword fallback: token strings are mapped
+# to int32 ids at ingest so the per-query scoring loop runs as a jitted
+# integer kernel instead of Python dict traffic
+try:
+    import numba
+    import numpy as np  # numba ships with numpy; rebind in case the block above failed
+    _NUMBA_AVAILABLE = True
+except ImportError:
+    _NUMBA_AVAILABLE = False
+
+term_to_id: Dict[str, int] = {}
+_kw_doc_ids: List[str] = []   # kernel row -> policy_id
+_kw_term_ids: List = []       # per doc: int32 array of unique term ids
+_kw_term_counts: List = []    # per doc: int32 array of matching counts
+_kw_title_ids: List = []      # per doc: int32 array of title term ids
+_kw_flat = None               # lazily concatenated kernel inputs
+
+
+def _term_id(term: str) -> int:
+    tid = term_to_id.get(term)
+    if tid is None:
+        tid = len(term_to_id)
+        term_to_id[term] = tid
+    return tid
+
+
+if _NUMBA_AVAILABLE:
+    @numba.njit(cache=True)
+    def _score_kernel(query_ids, term_flat, count_flat, offsets,
+                      title_flat, title_offsets, scores):
+        for d in range(len(scores)):
+            s = 0
+            for qi in query_ids:
+                for j in range(offsets[d], offsets[d + 1]):
+                    if term_flat[j] == qi:
+                        s += count_flat[j]
+                        break
+                for j in range(title_offsets[d], title_offsets[d + 1]):
+                    if title_flat[j] == qi:
+                        s += 10
+                        break
+            scores[d] = s
+
+    # Warm the JIT at import so the first real query doesn't pay compile latency
+    _score_kernel(np.zeros(1, np.int32), np.zeros(1, np.int32), np.zeros(1, np.int32),
+                  np.zeros(2, np.int64), np.zeros(1, np.int32), np.zeros(2, np.int64),
+                  np.zeros(1, np.int64))
+
+
+def _kw_flatten():
+    """Concatenate the per-doc arrays into the kernel's flat inputs (cached)"""
+    global _kw_flat
+    if _kw_flat is None:
+        offsets = np.zeros(len(_kw_term_ids) + 1, dtype=np.int64)
+        np.cumsum([len(a) for a in _kw_term_ids], out=offsets[1:])
+        title_offsets = np.zeros(len(_kw_title_ids) + 1, dtype=np.int64)
+        np.cumsum([len(a) for a in _kw_title_ids], out=title_offsets[1:])
+        _kw_flat = (
+            np.concatenate(_kw_term_ids) if _kw_term_ids else np.empty(0, np.int32),
+            np.concatenate(_kw_term_counts) if _kw_term_counts else np.empty(0, np.int32),
+            offsets,
+            np.concatenate(_kw_title_ids) if _kw_title_ids else np.empty(0, np.int32),
+            title_offsets,
+        )
+    return _kw_flat
+
+
+def _search_keyword_numba(query_words: List[str], cat: Optional[str], max_results: int) -> List[dict]:
+    """Score every document in one jitted pass over the flat token-id arrays"""
+    known = [term_to_id[w] for w in query_words if w in term_to_id]
+    results = []
+    if known:
+        query_ids = np.asarray(known, dtype=np.int32)
+        term_flat, count_flat, offsets, title_flat, title_offsets = _kw_flatten()
+        scores = np.zeros(len(_kw_doc_ids), dtype=np.int64)
+        _score_kernel(query_ids, term_flat, count_flat, offsets,
+                      title_flat, title_offsets, scores)
+        for d in np.nonzero(scores)[0]:
+            policy_id = _kw_doc_ids[d]
+            if cat is not None and doc_category_lower[policy_id] != cat:
+                continue
+            results.append(_result_entry(knowledge_base[policy_id], int(scores[d])))
+
+    return heapq.nlargest(max_results, results, key=itemgetter("relevance_score"))
+
+def _save_embedding(policy_id: str, vec):
+    _get_db().execute(
+        "UPDATE policies SET embedding = ? WHERE policy_id = ?",
+        (np.asarray(vec, dtype=np.float32).tobytes(), policy_id)
+    )
+
+
+def _ingest_policy(policy_id: str, title: str, content: str, category: str,
+                   created_at: Optional[str] = None, persist: bool = True) -> dict:
+    """Store a policy and build its keyword-index entries (no embedding)"""
+    # Re-adding an id is a replace: drop the old content's posting-list
+    # contributions first, otherwise the new counts stack on the old ones
+    if policy_id in knowledge_base:
+        old_content = knowledge_base[policy_id]["content"]
+        for term in set(_TOKEN_RE.findall(old_content.lower())):
+            postings[term].pop(policy_id, None)
+
+    doc = {
+        "policy_id": policy_id,
+        "title": title,
+        "content": content,
+        "category": category,
+        "created_at": created_at or _now_str(),
+        "word_count": len(content.split()),
+        # Sliced once here instead of per matching result on every query
+        "excerpt": content[:300] + "..." if len(content) > 300 else content
+    }
+    knowledge_base[policy_id] = doc
+
+    # Tokenise once at ingest so queries become posting-list lookups
+    tokens = _TOKEN_RE.findall(content.lower())
+    title_tokens = _TOKEN_RE.findall(title.lower())
+    for term in tokens:
+        postings[term][policy_id] += 1
+    title_terms[policy_id] = frozenset(title_tokens)
+    doc_category_lower[policy_id] = category.lower()
+
+    # Integer-encode the tokens for the jitted scoring kernel, replacing
+    # the document's existing arrays on re-add
+    if _NUMBA_AVAILABLE:
+        global _kw_flat
+        counts = Counter(tokens)
+        term_ids = np.asarray([_term_id(t) for t in counts], dtype=np.int32)
+        term_counts = np.asarray(list(counts.values()), dtype=np.int32)
+        title_ids = np.asarray([_term_id(t) for t in set(title_tokens)], dtype=np.int32)
+        if policy_id in _kw_doc_ids:
+            d = _kw_doc_ids.index(policy_id)
+            _kw_term_ids[d] = term_ids
+            _kw_term_counts[d] = term_counts
+            _kw_title_ids[d] = title_ids
+        else:
+            _kw_doc_ids.append(policy_id)
+            _kw_term_ids.append(term_ids)
+            _kw_term_counts.append(term_counts)
+            _kw_title_ids.append(title_ids)
+        _kw_flat = None
+
+    if persist:
+        _get_db().execute(
+            "INSERT OR REPLACE INTO policies (policy_id, title, content, category, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (policy_id, title, content, category, doc["created_at"])
+        )
+
+    return doc
+
+
 @mcp.tool()
 def add_policy_document(
     policy_id: str,
@@ -30,20 +553,76 @@ def add_policy_document(
     Add a policy document to the knowledge base for RAG retrieval.
     Categories: General, Annual, Sick, Emergency, Remote, Benefits
     """
-    knowledge_base[policy_id] = {
-        "policy_id": policy_id,
-        "title": title,
-        "content": content,
-        "category": category,
-        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "word_count": len(content.split())
-    }
-    
+    doc = _ingest_policy(policy_id, title, content, category)
+
+    # Encode once at ingest for the semantic search path; cached answers
+    # are stale once the corpus changes
+    if _EMB_AVAILABLE:
+        vec = _encode([content])[0]
+        _store_embedding(policy_id, vec)
+        _save_embedding(policy_id, vec)
+        _qa_cache_clear()
+
     return {
         "message": f"✅ Policy '{title}' added to knowledge base",
         "policy_id": policy_id,
         "category": category,
-        "word_count": len(content.split())
+        "word_count": doc["word_count"]
+    }
+
+
+@mcp.tool()
+def add_policy_documents(documents: List[dict]) -> dict:
+    """
+    Add several policy documents in one call (bulk ingest).
+    Each item needs policy_id, title and content; category is optional.
+    All contents are embedded in a single batched encoder call.
+    """
+    # Validate every item before touching any state, so a malformed entry
+    # can't leave the in-memory indexes ahead of the rolled-back DB write
+    for i, doc in enumerate(documents):
+        missing = [field for field in ("policy_id", "title", "content") if field not in doc]
+        if missing:
+            return {"error": f"Document at index {i} is missing required field(s): {', '.join(missing)}"}
+
+    added = [doc["policy_id"] for doc in documents]
+    contents = [doc["content"] for doc in documents]
+
+    # Encode before mutating anything: the one batched call amortises
+    # tokeniser and model overhead, and an encoder failure here leaves
+    # both the in-memory indexes and the database untouched
+    vecs = None
+    if _EMB_AVAILABLE and contents:
+        try:
+            vecs = _encode(contents)
+        except Exception as e:
+            return {"error": f"Failed to embed documents: {e}"}
+
+    db = _get_db()
+    db.execute("BEGIN")
+    try:
+        for doc in documents:
+            _ingest_policy(
+                doc["policy_id"],
+                doc["title"],
+                doc["content"],
+                doc.get("category", "General")
+            )
+
+        # _store_embedding replaces rows in place for re-added ids
+        if vecs is not None:
+            for policy_id, vec in zip(added, vecs):
+                _store_embedding(policy_id, vec)
+                _save_embedding(policy_id, vec)
+            _qa_cache_clear()
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+
+    return {
+        "message": f"✅ Added {len(added)} policies to knowledge base",
+        "policy_ids": added
     }
 
 @mcp.tool()
@@ -53,45 +632,40 @@ def search_policies(
     max_results: int = 3
 ) -> List[dict]:
     """
-    Search policy documents using simple keyword matching (RAG retrieval).
-    This simulates semantic search for demo purposes.
+    Search policy documents (RAG retrieval).
+    Uses embedding similarity when sentence-transformers is installed,
+    otherwise falls back to keyword matching over the inverted index.
     """
-    query_lower = query.lower()
-    results = []
-    
-    for policy_id, doc in knowledge_base.items():
-        # Filter by category if specified
-        if category and doc["category"].lower() != category.lower():
-            continue
-        
-        # Simple keyword matching (in production, use embeddings)
-        content_lower = doc["content"].lower()
-        title_lower = doc["title"].lower()
-        
-        # Calculate simple relevance score
-        score = 0
-        query_words = query_lower.split()
-        
-        for word in query_words:
-            if word in title_lower:
-                score += 10  # Title matches are more important
-            if word in content_lower:
-                score += content_lower.count(word)
-        
-        if score > 0:
-            results.append({
-                "policy_id": policy_id,
-                "title": doc["title"],
-                "category": doc["category"],
-                "relevance_score": score,
-                "excerpt": doc["content"][:300] + "..." if len(doc["content"]) > 300 else doc["content"],
-                "full_content": doc["content"]
-            })
-    
-    # Sort by relevance
-    results.sort(key=lambda x: x["relevance_score"], reverse=True)
-    
-    return results[:max_results]
+    if _EMB_AVAILABLE and _id_list:
+        return _search_semantic(query, category, max_results)
+
+    query_words = _TOKEN_RE.findall(query.lower())
+    cat = category.lower() if category else None
+
+    if _NUMBA_AVAILABLE and _kw_doc_ids:
+        return _search_keyword_numba(query_words, cat, max_results)
+
+    scores: Dict[str, int] = defaultdict(int)
+
+    # Filter by category while accumulating so excluded documents never
+    # make it into the score table at all
+    for word in query_words:
+        # Title matches are more important
+        for policy_id, terms in title_terms.items():
+            if word in terms and (cat is None or doc_category_lower[policy_id] == cat):
+                scores[policy_id] += 10
+        # Content hits come straight from the posting list for this term
+        for policy_id, count in postings.get(word, {}).items():
+            if cat is None or doc_category_lower[policy_id] == cat:
+                scores[policy_id] += count
+
+    results = [
+        _result_entry(knowledge_base[policy_id], score)
+        for policy_id, score in scores.items()
+    ]
+
+    # Top-k by relevance without sorting the full result list
+    return heapq.nlargest(max_results, results, key=itemgetter("relevance_score"))
 
 @mcp.tool()
 def ask_policy_question(question: str, category: Optional[str] = None) -> dict:
@@ -99,8 +673,18 @@ def ask_policy_question(question: str, category: Optional[str] = None) -> dict:
     Ask a question about leave policies (RAG-powered Q&A).
     The system will search relevant documents and provide an answer.
     """
-    # Search for relevant documents
-    relevant_docs = search_policies(question, category, max_results=3)
+    # Paraphrases of an earlier question hit the LSH cache and skip retrieval
+    q_emb = None
+    if _EMB_AVAILABLE and _id_list:
+        q_emb = _encode([question])[0]
+        cached = _qa_cache_get(q_emb, category)
+        if cached is not None:
+            return cached
+        # Reuse the embedding for retrieval so a miss costs one encode
+        relevant_docs = _search_semantic(question, category, 3, q=q_emb)
+    else:
+        # Search for relevant documents
+        relevant_docs = search_policies(question, category, max_results=3)
     
     if not relevant_docs:
         return {
@@ -123,7 +707,7 @@ def ask_policy_question(question: str, category: Optional[str] = None) -> dict:
         answer += f"{i}. From '{doc['title']}' ({doc['category']}):\n"
         answer += f"   {doc['excerpt']}\n\n"
     
-    return {
+    result = {
         "question": question,
         "answer": answer,
         "sources": [{"title": doc["title"], "policy_id": doc["policy_id"]} for doc in relevant_docs],
@@ -131,6 +715,11 @@ def ask_policy_question(question: str, category: Optional[str] = None) -> dict:
         "context_used": context
     }
 
+    if q_emb is not None:
+        _qa_cache_put(q_emb, category, result)
+
+    return result
+
 @mcp.tool()
 def list_all_policies(category: Optional[str] = None) -> List[dict]:
     """List all policy documents in the knowledge base"""
@@ -173,11 +762,17 @@ def register_employee(
         "name": name,
         "email": email,
         "department": department,
-        "join_date": datetime.now().strftime("%Y-%m-%d"),
+        "join_date": _today_str(),
         "status": "Active"
     }
     leave_balance[employee_id] = 20  # Default 20 days annual leave
-    
+    employees_by_dept[department.lower()].add(employee_id)
+    dept_counts[department] += 1
+    _get_db().execute(
+        "INSERT OR REPLACE INTO employees VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (employee_id, name, email, department, employees[employee_id]["join_date"], "Active", 20)
+    )
+
     return {
         "message": f"✅ Employee {name} registered successfully",
         "employee_id": employee_id,
@@ -190,33 +785,53 @@ def view_employee(employee_id: str) -> dict:
     if employee_id not in employees:
         return {"error": f"Employee {employee_id} not found"}
     
-    emp = employees[employee_id].copy()
-    emp["leave_balance"] = leave_balance.get(employee_id, 0)
-    
-    # Add request statistics
-    emp_requests = [r for r in leave_requests if r["employee_id"] == employee_id]
-    emp["total_requests"] = len(emp_requests)
-    emp["pending_requests"] = len([r for r in emp_requests if r["status"] == "Pending"])
-    emp["approved_requests"] = len([r for r in emp_requests if r["status"] == "Approved"])
-    
-    return emp
+    # Request statistics in a single pass over the employee's own requests
+    emp_requests = requests_by_employee.get(employee_id, ())
+    pending = approved = 0
+    for r in emp_requests:
+        if r["status"] == "Pending":
+            pending += 1
+        elif r["status"] == "Approved":
+            approved += 1
+
+    # Build the response dict directly; the result is serialised and
+    # discarded, so there's no point copying the stored record first
+    return {
+        **employees[employee_id],
+        "leave_balance": leave_balance.get(employee_id, 0),
+        "total_requests": len(emp_requests),
+        "pending_requests": pending,
+        "approved_requests": approved
+    }
 
 @mcp.tool()
 def list_all_employees(department: Optional[str] = None) -> List[dict]:
     """List all employees, optionally filtered by department"""
     emp_list = list(employees.values())
-    
+
     if department:
         emp_list = [e for e in emp_list if e["department"].lower() == department.lower()]
-    
-    # Add leave balance to each
-    for emp in emp_list:
-        emp["leave_balance"] = leave_balance.get(emp["employee_id"], 0)
-    
-    return emp_list
+
+    # Merge the balance into fresh dicts; writing it into the shared
+    # employee records would persist stale balances between calls
+    return [
+        {**e, "leave_balance": leave_balance.get(e["employee_id"], 0)}
+        for e in emp_list
+    ]
 
 # ========== LEAVE REQUEST MANAGEMENT ==========
 
+def _parse_ymd(s: str) -> int:
+    """Parse a fixed-format YYYY-MM-DD string straight to an ordinal day.
+
+    The format is fixed, so slicing out the integer fields avoids the
+    locale machinery of datetime.strptime on the request hot path.
+    """
+    if len(s) != 10 or s[4] != "-" or s[7] != "-":
+        raise ValueError(f"invalid date: {s!r}")
+    return date(int(s[0:4]), int(s[5:7]), int(s[8:10])).toordinal()
+
+
 @mcp.tool()
 def request_leave(
     employee_id: str,
@@ -235,17 +850,15 @@ def request_leave(
     
     # Calculate days
     try:
-        start = datetime.strptime(start_date, "%Y-%m-%d")
-        end = datetime.strptime(end_date, "%Y-%m-%d")
-        days_requested = (end - start).days + 1
-        
+        days_requested = _parse_ymd(end_date) - _parse_ymd(start_date) + 1
+
         if days_requested <= 0:
             return {"error": "End date must be after start date"}
     except ValueError:
         return {"error": "Invalid date format. Use YYYY-MM-DD"}
     
     # Check balance for Annual leave
-    if leave_type.lower() == "annual":
+    if _normalize_kw(leave_type, _LEAVE_TYPE_TABLE) is _ANNUAL:
         available = leave_balance.get(employee_id, 0)
         if days_requested > available:
             return {
@@ -264,13 +877,17 @@ def request_leave(
         "leave_type": leave_type,
         "reason": reason,
         "status": "Pending",
-        "submitted_date": datetime.now().strftime("%Y-%m-%d"),
+        "submitted_date": _today_str(),
         "approved_by": None,
         "approved_date": None
     }
     
     leave_requests.append(request)
-    
+    requests_by_employee[employee_id].append(request)
+    pending_requests[request_id] = request
+    requests_by_id[request_id] = request
+    _save_request(request)
+
     return {
         "message": "✅ Leave request submitted successfully!",
         "request_id": request_id,
@@ -283,29 +900,30 @@ def request_leave(
 @mcp.tool()
 def approve_leave(request_id: str, approver_id: str = "MANAGER") -> dict:
     """Approve a pending leave request"""
-    for req in leave_requests:
-        if req["request_id"] == request_id:
-            if req["status"] != "Pending":
-                return {"error": f"Request is already {req['status']}"}
-            
-            # Deduct from balance (for Annual leave)
-            if req["leave_type"].lower() == "annual":
-                emp_id = req["employee_id"]
-                leave_balance[emp_id] -= req["days"]
-            
-            req["status"] = "Approved"
-            req["approved_by"] = approver_id
-            req["approved_date"] = datetime.now().strftime("%Y-%m-%d")
-            
-            return {
-                "message": "✅ Leave request approved!",
-                "request_id": request_id,
-                "employee": req["employee_name"],
-                "days": req["days"],
-                "new_balance": leave_balance.get(req["employee_id"], 0)
-            }
-    
-    return {"error": f"Request {request_id} not found"}
+    req = requests_by_id.get(request_id)
+    if req is None:
+        return {"error": f"Request {request_id} not found"}
+    if req["status"] != "Pending":
+        return {"error": f"Request is already {req['status']}"}
+
+    # Deduct from balance (for Annual leave)
+    if _normalize_kw(req["leave_type"], _LEAVE_TYPE_TABLE) is _ANNUAL:
+        emp_id = req["employee_id"]
+        leave_balance[emp_id] -= req["days"]
+
+    _move_status(req, "Approved")
+    req["approved_by"] = approver_id
+    req["approved_date"] = _today_str()
+    _save_request(req)
+    _save_balance(req["employee_id"])
+
+    return {
+        "message": "✅ Leave request approved!",
+        "request_id": request_id,
+        "employee": req["employee_name"],
+        "days": req["days"],
+        "new_balance": leave_balance.get(req["employee_id"], 0)
+    }
 
 @mcp.tool()
 def reject_leave(
@@ -314,24 +932,24 @@ def reject_leave(
     approver_id: str = "MANAGER"
 ) -> dict:
     """Reject a pending leave request"""
-    for req in leave_requests:
-        if req["request_id"] == request_id:
-            if req["status"] != "Pending":
-                return {"error": f"Request is already {req['status']}"}
-            
-            req["status"] = "Rejected"
-            req["rejection_reason"] = reason
-            req["rejected_by"] = approver_id
-            req["rejected_date"] = datetime.now().strftime("%Y-%m-%d")
-            
-            return {
-                "message": "❌ Leave request rejected",
-                "request_id": request_id,
-                "employee": req["employee_name"],
-                "reason": reason
-            }
-    
-    return {"error": f"Request {request_id} not found"}
+    req = requests_by_id.get(request_id)
+    if req is None:
+        return {"error": f"Request {request_id} not found"}
+    if req["status"] != "Pending":
+        return {"error": f"Request is already {req['status']}"}
+
+    _move_status(req, "Rejected")
+    req["rejection_reason"] = reason
+    req["rejected_by"] = approver_id
+    req["rejected_date"] = _today_str()
+    _save_request(req)
+
+    return {
+        "message": "❌ Leave request rejected",
+        "request_id": request_id,
+        "employee": req["employee_name"],
+        "reason": reason
+    }
 
 @mcp.tool()
 def check_balance(employee_id: str) -> dict:
@@ -339,15 +957,21 @@ def check_balance(employee_id: str) -> dict:
     if employee_id not in employees:
         return {"error": f"Employee {employee_id} not found"}
     
-    emp_requests = [r for r in leave_requests if r["employee_id"] == employee_id]
-    
+    emp_requests = requests_by_employee.get(employee_id, ())
+    pending = approved = 0
+    for r in emp_requests:
+        if r["status"] == "Pending":
+            pending += 1
+        elif r["status"] == "Approved":
+            approved += 1
+
     return {
         "employee_id": employee_id,
         "employee_name": employees[employee_id]["name"],
         "leave_balance": leave_balance.get(employee_id, 0),
         "total_requests": len(emp_requests),
-        "pending_requests": len([r for r in emp_requests if r["status"] == "Pending"]),
-        "approved_requests": len([r for r in emp_requests if r["status"] == "Approved"]),
+        "pending_requests": pending,
+        "approved_requests": approved,
         "days_used_this_period": 20 - leave_balance.get(employee_id, 0)
     }
 
@@ -357,15 +981,17 @@ def view_all_requests(status: str = "All") -> List[dict]:
     View all leave requests, optionally filtered by status.
     Status options: All, Pending, Approved, Rejected
     """
-    if status.lower() == "all":
+    canon = _normalize_kw(status, _STATUS_TABLE)
+    if canon is _ALL:
         return leave_requests
-    else:
-        return [req for req in leave_requests if req["status"].lower() == status.lower()]
+    elif canon is not None:
+        return list(_status_requests(canon))
+    return []
 
 @mcp.tool()
 def view_my_requests(employee_id: str) -> List[dict]:
     """View all leave requests for a specific employee"""
-    return [req for req in leave_requests if req["employee_id"] == employee_id]
+    return list(requests_by_employee.get(employee_id, ()))
 
 # ========== ADMIN TOOLS ==========
 
@@ -376,7 +1002,8 @@ def add_leave_balance(employee_id: str, days: int) -> dict:
         return {"error": f"Employee {employee_id} not found"}
     
     leave_balance[employee_id] = leave_balance.get(employee_id, 0) + days
-    
+    _save_balance(employee_id)
+
     return {
         "message": f"✅ Added {days} days to balance",
         "employee": employees[employee_id]["name"],
@@ -396,24 +1023,24 @@ def department_summary(department: str = "All") -> dict:
         "rejected_requests": 0
     }
     
-    for emp_id, emp in employees.items():
-        if department.lower() == "all" or emp["department"].lower() == department.lower():
-            result["total_employees"] += 1
-            result["total_leave_balance"] += leave_balance.get(emp_id, 0)
-    
-    # Count requests
     if department.lower() == "all":
-        filtered_requests = leave_requests
+        result["total_employees"] = len(employees)
+        result["total_leave_balance"] = sum(leave_balance.values())
+        result["pending_requests"] = len(pending_requests)
+        result["approved_requests"] = len(requests_by_status["Approved"])
+        result["rejected_requests"] = len(requests_by_status["Rejected"])
+        result["total_requests"] = len(leave_requests)
     else:
-        filtered_requests = [
-            r for r in leave_requests 
-            if employees.get(r["employee_id"], {}).get("department", "").lower() == department.lower()
-        ]
-    
-    result["pending_requests"] = len([r for r in filtered_requests if r["status"] == "Pending"])
-    result["approved_requests"] = len([r for r in filtered_requests if r["status"] == "Approved"])
-    result["rejected_requests"] = len([r for r in filtered_requests if r["status"] == "Rejected"])
-    result["total_requests"] = len(filtered_requests)
+        # Only the department's own bucket gets touched
+        target = employees_by_dept.get(department.lower(), set())
+        result["total_employees"] = len(target)
+        result["total_leave_balance"] = sum(leave_balance.get(e, 0) for e in target)
+        total = 0
+        for status in ("Pending", "Approved", "Rejected"):
+            count = len([r for r in _status_requests(status) if r["employee_id"] in target])
+            result[f"{status.lower()}_requests"] = count
+            total += count
+        result["total_requests"] = total
     
     return result
 
@@ -423,12 +1050,12 @@ def system_stats() -> dict:
     return {
         "total_employees": len(employees),
         "total_leave_requests": len(leave_requests),
-        "pending_requests": len([r for r in leave_requests if r["status"] == "Pending"]),
-        "approved_requests": len([r for r in leave_requests if r["status"] == "Approved"]),
-        "rejected_requests": len([r for r in leave_requests if r["status"] == "Rejected"]),
+        "pending_requests": len(pending_requests),
+        "approved_requests": len(requests_by_status["Approved"]),
+        "rejected_requests": len(requests_by_status["Rejected"]),
         "total_policies": len(knowledge_base),
-        "departments": list(set(emp["department"] for emp in employees.values())),
-        "server_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        "departments": list(dept_counts),
+        "server_time": _now_str()
     }
 
 # ========== RESOURCES ==========
@@ -466,7 +1093,63 @@ def quick_start_guide() -> dict:
         "example_search": "search_policies('annual leave entitlement')"
     }
 
-# ========== DEMO DATA SETUP ==========
+# ========== STARTUP / DEMO DATA ==========
+
+def load_state():
+    """Hydrate the in-memory stores and indexes from SQLite on cold start"""
+    db = _get_db()
+
+    for emp_id, name, email, department, join_date, status, balance in db.execute(
+            "SELECT employee_id, name, email, department, join_date, status, leave_balance "
+            "FROM employees ORDER BY rowid"):
+        employees[emp_id] = {
+            "employee_id": emp_id,
+            "name": name,
+            "email": email,
+            "department": department,
+            "join_date": join_date,
+            "status": status
+        }
+        leave_balance[emp_id] = balance
+        employees_by_dept[department.lower()].add(emp_id)
+        dept_counts[department] += 1
+
+    for (data,) in db.execute("SELECT data FROM requests ORDER BY rowid"):
+        request = json.loads(data)
+        leave_requests.append(request)
+        requests_by_employee[request["employee_id"]].append(request)
+        if request["status"] == "Pending":
+            pending_requests[request["request_id"]] = request
+        else:
+            requests_by_status[request["status"]].append(request)
+        requests_by_id[request["request_id"]] = request
+
+    # The keyword indexes are rebuilt from the stored text (cheap), while
+    # embeddings come straight out of the BLOB column instead of paying a
+    # full re-encode of the corpus
+    unencoded = []
+    for policy_id, title, content, category, created_at, blob in db.execute(
+            "SELECT policy_id, title, content, category, created_at, embedding "
+            "FROM policies ORDER BY rowid"):
+        _ingest_policy(policy_id, title, content, category,
+                       created_at=created_at, persist=False)
+        if _EMB_AVAILABLE:
+            if blob is not None:
+                _append_embeddings(np.frombuffer(blob, dtype=np.float32).reshape(1, _EMB_DIM))
+                _id_list.append(policy_id)
+            else:
+                unencoded.append((policy_id, content))
+
+    # Rows without a stored vector (ingested while the encoder was
+    # unavailable, or a crash between the policy insert and the embedding
+    # update) would otherwise be invisible to the semantic path forever:
+    # encode them now in one batch and write the blobs back
+    if unencoded:
+        vecs = _encode([content for _, content in unencoded])
+        for (policy_id, _), vec in zip(unencoded, vecs):
+            _store_embedding(policy_id, vec)
+            _save_embedding(policy_id, vec)
+
 
 def setup_demo_data():
     """Initialize system with demo data"""
@@ -530,8 +1213,10 @@ def setup_demo_data():
 # ========== MAIN ENTRY POINT ==========
 
 if __name__ == "__main__":
-    # Setup demo data
-    setup_demo_data()
+    # Load persisted state; seed demo data only on a fresh database
+    load_state()
+    if not employees:
+        setup_demo_data()
     
     print("=" * 70)
     print("🏢 LEAVE MANAGEMENT SYSTEM WITH RAG")